@@ -5,11 +5,19 @@ import base64
 import time
 from pathlib import Path
 from typing import Dict, Any, Optional, Type
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import io
 
 from openfilter.filter_runtime.filter import FilterConfig, Filter, Frame
 
+# Optional: faster serialization for dataset exports. The stdlib fallback keeps
+# the export path pure Python, so it also runs on interpreters without orjson
+# wheels (e.g. PyPy).
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 __all__ = ['FilterChatTagConfig', 'FilterChatTag', 'CHATTAG_OUTPUT_SCHEMA_VERSION']
 
 logger = logging.getLogger(__name__)
@@ -21,6 +29,46 @@ CHATTAG_OUTPUT_SCHEMA_VERSION = "1.0"
 CHATTAG_META_KEY = "chattag"
 
 
+def _encode_json(obj: Any) -> bytes:
+    """Serialize obj as indented UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def _dump_json(path: Path, obj: Any) -> None:
+    """Serialize obj as indented UTF-8 JSON and write it to path in one call."""
+    with open(path, 'wb') as f:
+        f.write(_encode_json(obj))
+
+
+def _dump_json_stream(path: Path, head: Dict[str, Any], arrays) -> Dict[str, int]:
+    """Stream ``{**head, key: [items...], ...}`` to path atomically; returns the item count per key."""
+    counts = {}
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp_path, 'wb', buffering=1 << 20) as f:
+            sep = b"{\n  "
+            for key, value in head.items():
+                f.write(sep + _encode_json(key) + b": " + _encode_json(value).replace(b"\n", b"\n  "))
+                sep = b",\n  "
+            for key, items in arrays:
+                f.write(sep + _encode_json(key) + b": [")
+                sep = b",\n  "
+                count = 0
+                for item in items:
+                    f.write((b",\n    " if count else b"\n    ") + _encode_json(item).replace(b"\n", b"\n    "))
+                    count += 1
+                f.write(b"\n  ]" if count else b"]")
+                counts[key] = count
+            f.write(b"\n}")
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return counts
+
+
 class FilterChatTagConfig(FilterConfig):
     # LangChain model string: "provider:model" (e.g. "openai:gpt-4o-mini",
     # "google_genai:gemini-2.0-flash", "anthropic:claude-3-5-sonnet-latest",
@@ -629,30 +677,40 @@ class FilterChatTag(Filter):
             logger.error(f"Failed to save processed image for {frame_id}: {str(e)}")
             return None
 
-    def _generate_binary_datasets(self):
+    @staticmethod
+    def _load_label_records(jsonl_file: Path) -> tuple[list, set]:
+        """
+        Read labels.jsonl in a single pass, returning the records together
+        with the set of label names seen across all of them.
+        """
+        records = []
+        labels = set()
+        with open(jsonl_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records.append(record)
+                    # Via .keys(): the balanced export samples labels in this set's order
+                    labels.update(record["labels"].keys())
+        return records, labels
+
+    def _generate_binary_datasets(self, generated_at: Optional[float] = None):
         """Generate binary datasets from saved JSONL in dataset_langchain format."""
+        if generated_at is None:
+            generated_at = time.time()
         try:
             logger.info("Generating binary datasets from saved JSONL file...")
 
-            jsonl_file = self.output_dir / "labels.jsonl"
-            if not jsonl_file.exists():
+            try:
+                records, labels = self._load_label_records(self.output_dir / "labels.jsonl")
+            except FileNotFoundError:
                 logger.warning("No labels.jsonl file found in output directory")
                 return
 
-            records = []
-            with open(jsonl_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        records.append(json.loads(line.strip()))
-
             if not records:
                 logger.warning("No records found in JSONL file")
                 return
 
-            labels = set()
-            for record in records:
-                labels.update(record["labels"].keys())
-
             if not labels:
                 logger.warning("No labels found in records")
                 return
@@ -660,32 +718,40 @@ class FilterChatTag(Filter):
             binary_datasets_dir = self.output_dir / "binary_datasets"
             binary_datasets_dir.mkdir(exist_ok=True)
 
-            for label_name in labels:
-                dataset = {"annotations": []}
+            # Classify every (record, label) pair in one pass over the records,
+            # instead of rescanning all records once per label. The positive /
+            # negative file name split is reused by the balanced export.
+            datasets = {label_name: {"annotations": []} for label_name in labels}
+            samples = {label_name: ([], []) for label_name in labels}
+            threshold = self.confidence_threshold
 
-                for record in records:
-                    if label_name in record["labels"]:
-                        present = record["labels"][label_name].get('present', False)
-                        confidence = record["labels"][label_name].get('confidence', 0.0)
+            for record in records:
+                filename = record["image"].rpartition('/')[2]
+                for label_name, label_data in record["labels"].items():
+                    present = label_data.get('present', False)
+                    confidence = label_data.get('confidence', 0.0)
 
-                        binary_label = label_name if present and confidence >= self.confidence_threshold else "absent"
+                    if present and confidence >= threshold:
+                        binary_label = label_name
+                        samples[label_name][0].append(filename)
+                    else:
+                        binary_label = "absent"
+                        samples[label_name][1].append(filename)
 
-                        image_path = record["image"]
-                        filename = os.path.basename(image_path)
+                    datasets[label_name]["annotations"].append({
+                        "filename": filename,
+                        "label": binary_label
+                    })
 
-                        annotation = {
-                            "filename": filename,
-                            "label": binary_label
-                        }
-                        dataset["annotations"].append(annotation)
+            for label_name in labels:
+                dataset = datasets[label_name]
+                positive_count = len(samples[label_name][0])
 
                 dataset_file = binary_datasets_dir / f"{label_name}_labels.json"
 
-                with open(dataset_file, 'w', encoding='utf-8') as f:
-                    json.dump(dataset, f, indent=2, ensure_ascii=False)
+                _dump_json(dataset_file, dataset)
 
-                positive_count = sum(1 for ann in dataset["annotations"] if ann["label"] == label_name)
-                negative_count = sum(1 for ann in dataset["annotations"] if ann["label"] == "absent")
+                negative_count = len(dataset["annotations"]) - positive_count
 
                 logger.info(f"Generated {label_name} dataset: {positive_count} {label_name}, {negative_count} absent samples (overwrote existing file)")
 
@@ -694,23 +760,29 @@ class FilterChatTag(Filter):
                 "labels": sorted(list(labels)),
                 "total_frames": len(records),
                 "output_directory": str(binary_datasets_dir),
-                "generated_at": time.time()
+                "generated_at": generated_at
             }
 
             summary_file = binary_datasets_dir / "_summary_report.json"
-            with open(summary_file, 'w', encoding='utf-8') as f:
-                json.dump(summary, f, indent=2, ensure_ascii=False)
+            _dump_json(summary_file, summary)
 
             logger.info(f"Binary datasets generated successfully in: {binary_datasets_dir}")
             logger.info(f"Summary report saved to: {summary_file}")
 
-            self._generate_balanced_datasets(records, labels, binary_datasets_dir)
+            self._generate_balanced_datasets(records, labels, binary_datasets_dir, samples, generated_at)
 
         except Exception as e:
             logger.error(f"Failed to generate binary datasets: {str(e)}")
 
-    def _generate_balanced_datasets(self, records, labels, binary_datasets_dir):
-        """Generate balanced binary datasets where each class has equal representation."""
+    def _generate_balanced_datasets(self, records, labels, binary_datasets_dir, samples, generated_at: Optional[float] = None):
+        """
+        Generate balanced binary datasets where each class has equal representation.
+
+        ``samples`` maps each label to its ``(positive, negative)`` file name
+        lists, as classified by ``_generate_binary_datasets``.
+        """
+        if generated_at is None:
+            generated_at = time.time()
         try:
             logger.info("Generating balanced binary datasets...")
 
@@ -718,21 +790,7 @@ class FilterChatTag(Filter):
             balanced_datasets_dir.mkdir(exist_ok=True)
 
             for label in labels:
-                positive_samples = []
-                negative_samples = []
-
-                for record in records:
-                    if label in record["labels"]:
-                        present = record["labels"][label].get('present', False)
-                        confidence = record["labels"][label].get('confidence', 0.0)
-
-                        image_path = record["image"]
-                        filename = os.path.basename(image_path)
-
-                        if present and confidence >= self.confidence_threshold:
-                            positive_samples.append(filename)
-                        else:
-                            negative_samples.append(filename)
+                positive_samples, negative_samples = samples[label]
 
                 min_samples = min(len(positive_samples), len(negative_samples))
 
@@ -762,8 +820,7 @@ class FilterChatTag(Filter):
 
                 balanced_dataset_file = balanced_datasets_dir / f"{label}_labels.json"
 
-                with open(balanced_dataset_file, 'w', encoding='utf-8') as f:
-                    json.dump(balanced_dataset, f, indent=2, ensure_ascii=False)
+                _dump_json(balanced_dataset_file, balanced_dataset)
 
                 logger.info(f"Generated balanced {label} dataset: {len(balanced_positive)} {label}, {len(balanced_negative)} absent samples")
 
@@ -781,12 +838,11 @@ class FilterChatTag(Filter):
                     "method": "equal_sampling",
                     "description": "Each class has equal representation (balanced)"
                 },
-                "generated_at": time.time()
+                "generated_at": generated_at
             }
 
             balanced_summary_file = balanced_datasets_dir / "_summary_report.json"
-            with open(balanced_summary_file, 'w', encoding='utf-8') as f:
-                json.dump(balanced_summary, f, indent=2, ensure_ascii=False)
+            _dump_json(balanced_summary_file, balanced_summary)
 
             logger.info(f"Balanced datasets generated successfully in: {balanced_datasets_dir}")
             logger.info(f"Balanced summary report saved to: {balanced_summary_file}")
@@ -794,33 +850,26 @@ class FilterChatTag(Filter):
         except Exception as e:
             logger.error(f"Failed to generate balanced datasets: {str(e)}")
 
-    def _generate_multilabel_coco_datasets(self):
+    def _generate_multilabel_coco_datasets(self, generated_at: Optional[float] = None):
         """
         Build a COCO-style JSON from labels.jsonl for multilabel workflows.
         Each positive label (per confidence threshold) gets one full-image box.
         """
+        if generated_at is None:
+            generated_at = time.time()
         try:
             logger.info("Generating multilabel COCO datasets...")
 
-            jsonl_file = self.output_dir / "labels.jsonl"
-            if not jsonl_file.exists():
+            try:
+                records, labels = self._load_label_records(self.output_dir / "labels.jsonl")
+            except FileNotFoundError:
                 logger.warning("No labels.jsonl file found in output directory")
                 return
 
-            records = []
-            with open(jsonl_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        records.append(json.loads(line.strip()))
-
             if not records:
                 logger.warning("No records found in JSONL file")
                 return
 
-            labels = set()
-            for record in records:
-                labels.update(record["labels"].keys())
-
             if not labels:
                 logger.warning("No labels found in records")
                 return
@@ -828,111 +877,140 @@ class FilterChatTag(Filter):
             multilabel_datasets_dir = self.output_dir / "multilabel_datasets"
             multilabel_datasets_dir.mkdir(exist_ok=True)
 
-            coco_dataset = {
-                "info": {
-                    "description": "ChatTag Multilabel Dataset",
-                    "version": "1.0",
-                    "year": 2024,
-                    "contributor": "FilterChatTag",
-                    "date_created": time.strftime("%Y-%m-%d %H:%M:%S")
-                },
-                "licenses": [{"id": 1, "name": "Unknown", "url": ""}],
-                "images": [],
-                "annotations": [],
-                "categories": []
-            }
-
+            # Build the categories array and the name -> id mapping in one pass
+            categories = []
+            category_mapping = {}
             for idx, label in enumerate(sorted(labels), 1):
-                coco_dataset["categories"].append({
+                category_mapping[label] = idx
+                categories.append({
                     "id": idx,
                     "name": label,
                     "supercategory": "object"
                 })
 
-            category_mapping = {label: idx for idx, label in enumerate(sorted(labels), 1)}
-
-            try:
-                import cv2
-            except ImportError:
-                cv2 = None
-
-            annotation_id = 1
-            for image_id, record in enumerate(records, 1):
+            # File names and sizes are needed by both the images and annotations
+            # arrays, so read them up front and keep only those per record.
+            # Image.open only parses the file header; pixels are never decoded.
+            image_entries = [None] * len(records)
+            for index, record in enumerate(records):
                 image_path = record["image"]
-                filename = os.path.basename(image_path)
+                filename = image_path.rpartition('/')[2]
 
                 width, height = 640, 480
-                if cv2 is not None:
-                    try:
-                        full_image_path = self.output_dir / image_path
-                        if full_image_path.exists():
-                            img = cv2.imread(str(full_image_path))
-                            if img is not None:
-                                height, width = img.shape[:2]
-                            else:
-                                logger.warning(
-                                    "cv2.imread returned no data for %s (corrupt or unsupported format); "
-                                    "using fallback dimensions 640x480 for COCO export",
-                                    filename,
-                                )
-                        else:
-                            logger.warning(
-                                "Image not found at %s for COCO export; using fallback dimensions 640x480",
-                                full_image_path,
-                            )
-                    except Exception as e:
-                        logger.warning(f"Could not read image dimensions for {filename}: {e}")
-
-                coco_dataset["images"].append({
-                    "id": image_id,
-                    "width": width,
-                    "height": height,
-                    "file_name": filename,
-                    "license": 1,
-                    "flickr_url": "",
-                    "coco_url": "",
-                    "date_captured": 0
-                })
-
-                for label_name, label_data in record["labels"].items():
-                    if (label_data.get('present', False) and
-                            label_data.get('confidence', 0.0) >= self.confidence_threshold):
-                        bbox = [0, 0, width, height]
-                        area = width * height
-                        coco_dataset["annotations"].append({
-                            "id": annotation_id,
-                            "image_id": image_id,
-                            "category_id": category_mapping[label_name],
-                            "segmentation": [],
-                            "area": area,
-                            "bbox": bbox,
-                            "iscrowd": 0
-                        })
-                        annotation_id += 1
+                full_image_path = self.output_dir / image_path
+                try:
+                    with Image.open(full_image_path) as img:
+                        width, height = img.size
+                except FileNotFoundError:
+                    logger.warning(
+                        "Image not found at %s for COCO export; using fallback dimensions 640x480",
+                        full_image_path,
+                    )
+                except UnidentifiedImageError:
+                    logger.warning(
+                        "Could not identify image %s (corrupt or unsupported format); "
+                        "using fallback dimensions 640x480 for COCO export",
+                        filename,
+                    )
+                except Exception as e:
+                    logger.warning(f"Could not read image dimensions for {filename}: {e}")
+
+                image_entries[index] = (filename, width, height)
+
+            # Templates carry the constant fields (and the COCO key order);
+            # each entry is a shallow copy with only the varying fields set.
+            image_template = {
+                "id": 0,
+                "width": 0,
+                "height": 0,
+                "file_name": "",
+                "license": 1,
+                "flickr_url": "",
+                "coco_url": "",
+                "date_captured": 0
+            }
+            annotation_template = {
+                "id": 0,
+                "image_id": 0,
+                "category_id": 0,
+                "segmentation": [],
+                "area": 0,
+                "bbox": None,
+                "iscrowd": 0
+            }
 
+            def iter_images():
+                for image_id, (filename, width, height) in enumerate(image_entries, 1):
+                    image_info = image_template.copy()
+                    image_info["id"] = image_id
+                    image_info["width"] = width
+                    image_info["height"] = height
+                    image_info["file_name"] = filename
+                    yield image_info
+
+            def iter_annotations():
+                # Bind attribute/method lookups once; this is the per-label hot loop
+                threshold = self.confidence_threshold
+                category_of = category_mapping.__getitem__
+                new_annotation = annotation_template.copy
+
+                annotation_id = 1
+                for image_id, (record, (_, width, height)) in enumerate(zip(records, image_entries), 1):
+                    # Full-image box, shared by every annotation on this image
+                    bbox = [0, 0, width, height]
+                    area = width * height
+                    for label_name, label_data in record["labels"].items():
+                        get = label_data.get
+                        if get('present', False) and get('confidence', 0.0) >= threshold:
+                            annotation = new_annotation()
+                            annotation["id"] = annotation_id
+                            annotation["image_id"] = image_id
+                            annotation["category_id"] = category_of(label_name)
+                            annotation["area"] = area
+                            annotation["bbox"] = bbox
+                            yield annotation
+                            annotation_id += 1
+
+            # Stream the COCO file: images and annotations are encoded one at a
+            # time instead of materializing the full dataset dict first.
             coco_file = multilabel_datasets_dir / "annotations.json"
-            with open(coco_file, 'w', encoding='utf-8') as f:
-                json.dump(coco_dataset, f, indent=2, ensure_ascii=False)
+            counts = _dump_json_stream(
+                coco_file,
+                {
+                    "info": {
+                        "description": "ChatTag Multilabel Dataset",
+                        "version": "1.0",
+                        "year": 2024,
+                        "contributor": "FilterChatTag",
+                        "date_created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(generated_at))
+                    },
+                    "licenses": [{"id": 1, "name": "Unknown", "url": ""}],
+                },
+                [
+                    ("images", iter_images()),
+                    ("annotations", iter_annotations()),
+                    ("categories", categories),
+                ],
+            )
 
             summary = {
                 "task_type": "multilabel_classification",
                 "format": "COCO",
-                "total_classes": len(labels),
-                "classes": sorted(list(labels)),
+                "total_classes": len(categories),
+                "classes": list(category_mapping),  # already in sorted order
                 "category_mapping": category_mapping,
-                "total_images": len(records),
-                "total_annotations": annotation_id - 1,
+                "total_images": counts["images"],
+                "total_annotations": counts["annotations"],
                 "output_directory": str(multilabel_datasets_dir),
                 "confidence_threshold": self.confidence_threshold,
                 "coco_file": str(coco_file),
                 "bbox_type": "full_image_bbox",
                 "description": "Each present label gets a bounding box covering the entire image",
-                "generated_at": time.time()
+                "generated_at": generated_at
             }
 
             summary_file = multilabel_datasets_dir / "_summary_report.json"
-            with open(summary_file, 'w', encoding='utf-8') as f:
-                json.dump(summary, f, indent=2, ensure_ascii=False)
+            _dump_json(summary_file, summary)
 
             logger.info(f"Multilabel COCO dataset generated in: {multilabel_datasets_dir}")
 
@@ -943,10 +1021,12 @@ class FilterChatTag(Filter):
         logger.info("========= Shutting down FilterChatTag =========")
 
         if self.save_frames and self.output_dir and self.output_dir.exists():
-            self._generate_binary_datasets()
+            # Both exports stamp the same run timestamp
+            generated_at = time.time()
+            self._generate_binary_datasets(generated_at)
             if self.output_schema and len(self.output_schema) > 1:
                 logger.info("Multiple classes detected — generating multilabel COCO export...")
-                self._generate_multilabel_coco_datasets()
+                self._generate_multilabel_coco_datasets(generated_at)
 
         self._chain = None
         logger.info("FilterChatTag shutdown complete.")
@@ -1,56 +1,107 @@
+import functools
+import re
 import shutil
+import stat
 import tomllib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from shlex import quote as shell_quote
 import os
 # Constants
 MODELS_DIR = Path("models").resolve()              # Absolute path to local models directory
 ENTRYPOINT = Path("entrypoint.sh").resolve()       # Path to entrypoint script to be generated
 MODELS_TOML = Path("models.toml")                  # Config file defining model metadata
+CONTAINER_MODELS_PREFIX = "/app/models/"           # Where MODELS_DIR lands inside the image
 
+_HOME_STR = str(Path.home())                       # Host home dir, resolved once
+
+# $name / ${name} references, matched in a single linear pass (see _expandvars).
+# The optional "}" lets an unterminated "${" consume the rest of the string
+# instead of being rescanned from every later "$".
+_VAR_RE = re.compile(r"\$(\w+|\{[^}]*\}?)", re.ASCII)
+
+@functools.lru_cache(maxsize=1)
 def load_config():
     """
     Load the TOML configuration file and return the parsed dictionary.
+    The result is cached, so repeated calls do not re-read models.toml.
     """
-    with open(MODELS_TOML, "rb") as f:
-        return tomllib.load(f)
+    return tomllib.loads(MODELS_TOML.read_bytes().decode("utf-8"))
 
 def prepare_custom(source_path: Path) -> Path:
     """
     Copy a file or directory from source_path into the models directory.
+    source_path is expected to be already expanded and resolved by the caller.
     Returns the new local path under MODELS_DIR.
     """
-    source_path = source_path.expanduser().resolve()
     target = MODELS_DIR / source_path.name
 
-    if target.exists() and source_path.samefile(target):
+    # Stat source and target once each and reuse the results below
+    try:
+        st_src = os.stat(source_path)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Model path not found: {source_path}") from None
+
+    try:
+        st_tgt = os.stat(target)
+        same = (st_src.st_ino, st_src.st_dev) == (st_tgt.st_ino, st_tgt.st_dev)
+    except FileNotFoundError:
+        same = False
+
+    if same:
         print(f"⚠️  Warning: Source and destination are the same: {source_path}")
         return target
 
-    if source_path.is_file():
-        shutil.copy2(source_path, target)
-    elif source_path.is_dir():
-        shutil.copytree(source_path, target, dirs_exist_ok=True)
+    # copyfile uses the kernel fast-copy path (sendfile/copy_file_range) and
+    # skips copy2's copystat; only the permission bits are worth keeping.
+    # shutil.copy is copyfile plus copymode, so files inside directory
+    # models keep their permission bits too.
+    if stat.S_ISREG(st_src.st_mode):
+        shutil.copyfile(source_path, target)
+        os.chmod(target, stat.S_IMODE(st_src.st_mode))
+    elif stat.S_ISDIR(st_src.st_mode):
+        shutil.copytree(source_path, target, copy_function=shutil.copy, dirs_exist_ok=True)
     else:
         raise FileNotFoundError(f"Model path not found: {source_path}")
 
     return target
 
+def _expandvars(path_str: str) -> str:
+    """Expand $name and ${name} like os.path.expandvars, using a precompiled regex."""
+    if "$" not in path_str:
+        return path_str
+
+    def replace(match):
+        name = match.group(1)
+        if name.startswith("{"):
+            if not name.endswith("}"):
+                return match.group(0)
+            name = name[1:-1]
+        return os.environ.get(name, match.group(0))
+
+    return _VAR_RE.sub(replace, path_str)
+
 def normalize_home_path(path_str: str) -> str:
     """
     Replace $HOME or ~ with /root (Docker home) for container paths.
     Absolute paths without $HOME or ~ are left untouched.
     """
-    if "$HOME" in path_str or path_str.startswith("~"):
-        expanded = os.path.expandvars(os.path.expanduser(path_str))
-        return expanded.replace(str(Path.home()), "/root", 1)
+    # Fast path: one char compare plus one substring scan, no expansion calls
+    if not path_str or (path_str[0] != "~" and "$HOME" not in path_str):
+        return path_str
 
-    return path_str
+    expanded = _expandvars(os.path.expanduser(path_str))
+    return expanded.replace(_HOME_STR, "/root", 1)
 
-def shell_quote(path: str) -> str:
+def prepare_custom_group(source_paths: list[Path]) -> Path:
     """
-    Return a shell-quoted version of a path string for safe inclusion in bash commands.
+    Copy sources that share a target name one after another, in config order,
+    so parallel workers never write the same file under MODELS_DIR.
+    Returns the local path under MODELS_DIR.
     """
-    return f'"{path}"'
+    for source_path in source_paths:
+        target = prepare_custom(source_path)
+    return target
 
 def main():
     # Ensure models directory exists
@@ -58,14 +109,9 @@ def main():
 
     # Load the model configuration
     config = load_config()
-    symlink_commands = []
+    tasks = []                # (host path, container target path), in config order
 
-    # Start entrypoint.sh with bash init and optional cleanup
-    with open(ENTRYPOINT, "w") as f:
-        f.write("#!/bin/bash\nset -e\n\n")
-        f.write("echo 'Creating symlinks'\n")
-    
-    # Process each model defined in the config
+    # Pass 1: parse each model defined in the config (no I/O)
     for name, model in config.items():
         if name == "default":
             continue
@@ -76,26 +122,22 @@ def main():
         if model_type in {"custom", "protege"}:
             # Get host and optional container paths
             path_str = model["path"]
-            host_path = Path(os.path.expandvars(path_str)).expanduser().resolve()
-            copied_path = prepare_custom(host_path)
+            host_path = Path(_expandvars(path_str)).expanduser().resolve()
 
             container_path = model.get("container_path", path_str) 
             container_path = normalize_home_path(container_path)
+            if "$" in container_path:
+                # entrypoint.sh single-quotes every path, so bash will not
+                # expand this at container start either
+                print(f"⚠️  Warning: container_path for '{name}' keeps a literal '$': {container_path}")
 
-            # Resolve container-side symlink path
+            # Resolve container-side symlink path. Lexical normalization only:
+            # the container filesystem does not exist at build time.
             container_target_path = Path(container_path)
             if not container_target_path.is_absolute():
-                container_target_path = (Path("/app") / container_target_path).resolve()
-
-            # Prepare symlink shell commands for Docker startup
-            model_file_name = copied_path.name
-            quote_model_file_name = shell_quote("/app/models/" + model_file_name)
-            symlink_commands.append(
-                f"mkdir -p {shell_quote(container_target_path.parent)}"
-            )
-            symlink_commands.append(
-                f"ln -sf {quote_model_file_name} {shell_quote(container_target_path)}"
-            )
+                container_target_path = Path(os.path.normpath(Path("/app") / container_target_path))
+
+            tasks.append((host_path, container_target_path))
 
         elif model_type == "hf":
             # Placeholder: HF models handled via environment variables
@@ -104,14 +146,42 @@ def main():
         else:
             raise ValueError(f"Unsupported model type: {model_type}")
 
-    # Append symlink commands to entrypoint script
-    with open(ENTRYPOINT, "a") as f:
-        for cmd in symlink_commands:
-            f.write(cmd + "\n")
-        f.write("\n")
-        f.write("echo '✅ Model symlinks setup complete'\n")
-        f.write("# Execute the passed command\n")
-        f.write('exec "$@"\n')
+    # Pass 2: copy models concurrently; copies are I/O-bound and release the GIL
+    groups = {}
+    for host_path, _ in tasks:
+        groups.setdefault(host_path.name, []).append(host_path)
+
+    copied = {}
+    if groups:
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as ex:
+            for name, copied_path in zip(groups, ex.map(prepare_custom_group, groups.values())):
+                copied[name] = copied_path
+
+    # Pass 3: record symlink commands for Docker startup in config order. Each
+    # parent dir is created just before its first link, as a target nested
+    # under an earlier symlinked target must resolve through that link.
+    symlink_parents = set()   # Container dirs already created
+    symlink_commands = []
+    for host_path, container_target_path in tasks:
+        model_file_name = copied[host_path.name].name
+        quote_model_file_name = shell_quote(CONTAINER_MODELS_PREFIX + model_file_name)
+        parent = str(container_target_path.parent)
+        if parent not in symlink_parents:
+            symlink_parents.add(parent)
+            symlink_commands.append(f"mkdir -p {shell_quote(parent)}")
+        symlink_commands.append(
+            f"ln -sf {quote_model_file_name} {shell_quote(str(container_target_path))}"
+        )
+
+    # Build the whole entrypoint script in memory and write it once
+    parts = ["#!/bin/bash\nset -e\n\necho 'Creating symlinks'\n"]
+    parts.extend(cmd + "\n" for cmd in symlink_commands)
+    parts.append(
+        "\necho '✅ Model symlinks setup complete'\n"
+        "# Execute the passed command\n"
+        'exec "$@"\n'
+    )
+    ENTRYPOINT.write_text("".join(parts))
 
     ENTRYPOINT.chmod(0o755)  # Make entrypoint executable
     print("✅ Prepared models and wrote symlink logic to entrypoint.sh")
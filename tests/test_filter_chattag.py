@@ -28,6 +28,12 @@ LOG_LEVEL = logger.getEffectiveLevel()
 
 class TestFilterChatTag(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        # Pixel values are never inspected and never modified, so one blank
+        # image is shared by every test
+        cls.test_image = np.zeros((100, 100, 3), dtype=np.uint8)
+
     def setUp(self):
         self.temp_dir = tempfile.mkdtemp()
 
@@ -47,8 +53,7 @@ class TestFilterChatTag(unittest.TestCase):
             forward_main=False
         )
 
-        self.test_image = np.random.randint(0, 255, (100, 100, 3), dtype=np.uint8)
-
+        # Fresh Frame per test: process() writes results into the frame's meta dict
         self.test_frame = Frame(
             image=self.test_image,
             data={"meta": {"id": "test_frame_001"}},
@@ -305,6 +310,183 @@ class TestFilterChatTag(unittest.TestCase):
                 if key in os.environ:
                     del os.environ[key]
 
+    def test_multilabel_coco_export(self):
+        """COCO export writes one full-image box per confident positive label."""
+        output_dir = os.path.join(self.temp_dir, "out")
+        config = FilterChatTagConfig(
+            chattag_model="openai:gpt-4o-mini",
+            prompt=self.prompt_file,
+            output_schema={
+                "item1": {"present": False, "confidence": 0.0},
+                "item2": {"present": False, "confidence": 0.0}
+            },
+            save_frames=True,
+            output_dir=output_dir,
+            no_ops=True,
+            confidence_threshold=0.8
+        )
+
+        filter_instance = FilterChatTag(config)
+        filter_instance.setup(config)
+
+        records = [
+            {"image": "data/a.png", "labels": {
+                "item2": {"present": True, "confidence": 0.9},
+                "item1": {"present": True, "confidence": 0.5}}},
+            {"image": "data/b.png", "labels": {
+                "item1": {"present": True, "confidence": 0.95},
+                "item2": {"present": False, "confidence": 0.1}}},
+        ]
+        with open(os.path.join(output_dir, "labels.jsonl"), 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+        # Only b.png exists on disk; a.png falls back to 640x480
+        from PIL import Image
+        os.makedirs(os.path.join(output_dir, "data"))
+        Image.new("RGB", (32, 16)).save(os.path.join(output_dir, "data", "b.png"))
+
+        filter_instance._generate_multilabel_coco_datasets()
+
+        with open(os.path.join(output_dir, "multilabel_datasets", "annotations.json")) as f:
+            coco = json.load(f)
+
+        self.assertEqual([c["name"] for c in coco["categories"]], ["item1", "item2"])
+        self.assertEqual([img["file_name"] for img in coco["images"]], ["a.png", "b.png"])
+
+        cat_ids = {c["name"]: c["id"] for c in coco["categories"]}
+        self.assertEqual(
+            [(a["id"], a["image_id"], a["category_id"]) for a in coco["annotations"]],
+            [(1, 1, cat_ids["item2"]), (2, 2, cat_ids["item1"])]
+        )
+        self.assertEqual(coco["annotations"][0]["bbox"], [0, 0, 640, 480])
+        self.assertEqual((coco["images"][1]["width"], coco["images"][1]["height"]), (32, 16))
+        self.assertEqual(coco["annotations"][1]["bbox"], [0, 0, 32, 16])
+        self.assertEqual(coco["annotations"][1]["area"], 32 * 16)
+
+        with open(os.path.join(output_dir, "multilabel_datasets", "_summary_report.json")) as f:
+            summary = json.load(f)
+        self.assertEqual(summary["total_images"], 2)
+        self.assertEqual(summary["total_annotations"], 2)
+        self.assertEqual(summary["category_mapping"], cat_ids)
+
+    def test_multilabel_coco_export_keeps_previous_file_on_error(self):
+        """A malformed record mid-stream leaves the previous annotations.json in place."""
+        output_dir = os.path.join(self.temp_dir, "out")
+        config = FilterChatTagConfig(
+            chattag_model="openai:gpt-4o-mini",
+            prompt=self.prompt_file,
+            output_schema={"item1": {"present": False, "confidence": 0.0}},
+            save_frames=True,
+            output_dir=output_dir,
+            no_ops=True,
+            confidence_threshold=0.8
+        )
+
+        filter_instance = FilterChatTag(config)
+        filter_instance.setup(config)
+
+        coco_dir = os.path.join(output_dir, "multilabel_datasets")
+        os.makedirs(coco_dir)
+        coco_file = os.path.join(coco_dir, "annotations.json")
+        with open(coco_file, 'w') as f:
+            f.write('{"previous": true}')
+
+        # The second record's label value is not a dict, so annotation
+        # streaming fails after the images array has been written
+        records = [
+            {"image": "data/a.png", "labels": {
+                "item1": {"present": True, "confidence": 0.9}}},
+            {"image": "data/b.png", "labels": {"item1": None}},
+        ]
+        with open(os.path.join(output_dir, "labels.jsonl"), 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+        filter_instance._generate_multilabel_coco_datasets()
+
+        with open(coco_file) as f:
+            self.assertEqual(f.read(), '{"previous": true}')
+        self.assertEqual(os.listdir(coco_dir), ["annotations.json"])
+
+    def test_binary_datasets_export(self):
+        """Binary export labels each record per label; balanced export keeps min(pos, neg) of each class."""
+        output_dir = os.path.join(self.temp_dir, "out")
+        config = FilterChatTagConfig(
+            chattag_model="openai:gpt-4o-mini",
+            prompt=self.prompt_file,
+            output_schema={
+                "item1": {"present": False, "confidence": 0.0},
+                "item2": {"present": False, "confidence": 0.0}
+            },
+            save_frames=True,
+            output_dir=output_dir,
+            no_ops=True,
+            confidence_threshold=0.8
+        )
+
+        filter_instance = FilterChatTag(config)
+        filter_instance.setup(config)
+
+        # item2 is missing from d.png and e.png; c.png's item1 is under threshold
+        records = [
+            {"image": "data/a.png", "labels": {
+                "item1": {"present": True, "confidence": 0.9},
+                "item2": {"present": True, "confidence": 0.85}}},
+            {"image": "data/b.png", "labels": {
+                "item1": {"present": True, "confidence": 0.95},
+                "item2": {"present": False, "confidence": 0.1}}},
+            {"image": "data/c.png", "labels": {
+                "item1": {"present": True, "confidence": 0.5},
+                "item2": {"present": False, "confidence": 0.2}}},
+            {"image": "data/d.png", "labels": {
+                "item1": {"present": False, "confidence": 0.1}}},
+            {"image": "data/e.png", "labels": {
+                "item1": {"present": False, "confidence": 0.0}}},
+        ]
+        with open(os.path.join(output_dir, "labels.jsonl"), 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+        filter_instance._generate_binary_datasets()
+
+        binary_dir = os.path.join(output_dir, "binary_datasets")
+        with open(os.path.join(binary_dir, "item1_labels.json")) as f:
+            item1 = json.load(f)
+        with open(os.path.join(binary_dir, "item2_labels.json")) as f:
+            item2 = json.load(f)
+
+        self.assertEqual(item1["annotations"], [
+            {"filename": "a.png", "label": "item1"},
+            {"filename": "b.png", "label": "item1"},
+            {"filename": "c.png", "label": "absent"},
+            {"filename": "d.png", "label": "absent"},
+            {"filename": "e.png", "label": "absent"},
+        ])
+        # Records without item2 are left out of its dataset entirely
+        self.assertEqual(item2["annotations"], [
+            {"filename": "a.png", "label": "item2"},
+            {"filename": "b.png", "label": "absent"},
+            {"filename": "c.png", "label": "absent"},
+        ])
+
+        with open(os.path.join(binary_dir, "_summary_report.json")) as f:
+            summary = json.load(f)
+        self.assertEqual(summary["total_datasets"], 2)
+        self.assertEqual(summary["labels"], ["item1", "item2"])
+        self.assertEqual(summary["total_frames"], 5)
+
+        balanced_dir = os.path.join(output_dir, "binary_datasets_balanced")
+        for label, dataset, expected in (("item1", item1, 2), ("item2", item2, 1)):
+            with open(os.path.join(balanced_dir, f"{label}_labels.json")) as f:
+                balanced = json.load(f)["annotations"]
+            positives = [a for a in balanced if a["label"] == label]
+            negatives = [a for a in balanced if a["label"] == "absent"]
+            self.assertEqual((len(positives), len(negatives)), (expected, expected))
+            # Every balanced sample comes from the binary dataset with the same label
+            for annotation in balanced:
+                self.assertIn(annotation, dataset["annotations"])
+
     def test_build_schema_returns_pydantic_model(self):
         """_build_schema generates a Pydantic model with a field per label."""
         schema = FilterChatTag._build_schema({
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import os
+import posixpath
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prepare_models
+from prepare_models import _expandvars, normalize_home_path
+
+
+class TestExpandVars(unittest.TestCase):
+
+    @patch.dict(os.environ, {"A": "x", "MODEL_DIR": "/models"})
+    def test_matches_posixpath_for_well_formed_references(self):
+        """$name and ${name} expand like posixpath.expandvars; unknown names are kept."""
+        for path in ("plain/path", "$MODEL_DIR/m.pt", "${MODEL_DIR}/m.pt", "$A$A/${A}",
+                     "$UNSET/m.pt", "${UNSET}", "cost$", "a$/b", "${}"):
+            self.assertEqual(_expandvars(path), posixpath.expandvars(path), path)
+
+    @patch.dict(os.environ, {"A": "x"})
+    def test_unterminated_brace_keeps_rest_of_string(self):
+        """An unterminated ${ is left as-is together with the rest of the string."""
+        self.assertEqual(_expandvars("${$A"), "${$A")
+        self.assertEqual(_expandvars("$A/${B/$A"), "x/${B/$A")
+
+
+@patch.object(prepare_models, "_HOME_STR", "/home/u")
+@patch.dict(os.environ, {"HOME": "/home/u", "MODEL_DIR": "models"})
+class TestNormalizeHomePath(unittest.TestCase):
+
+    def test_home_references_map_to_root(self):
+        """$HOME and a leading ~ become /root."""
+        for path in ("$HOME/m.pt", "~/m.pt"):
+            self.assertEqual(normalize_home_path(path), "/root/m.pt", path)
+
+    def test_other_variables_expand_next_to_home(self):
+        """Other $VARs in a $HOME or ~ path are expanded at build time."""
+        self.assertEqual(normalize_home_path("$HOME/$MODEL_DIR/m.pt"), "/root/models/m.pt")
+        self.assertEqual(normalize_home_path("~/${MODEL_DIR}/m.pt"), "/root/models/m.pt")
+
+    def test_paths_without_home_are_untouched(self):
+        """Paths without $HOME or ~ are returned unchanged."""
+        for path in ("/opt/$MODEL_DIR/m.pt", "$HOMEDIR/m.pt", "models/m.pt"):
+            self.assertEqual(normalize_home_path(path), path)
+
+
+
+class TestEntrypoint(unittest.TestCase):
+
+    def test_parent_dirs_are_created_just_before_their_links(self):
+        """Each mkdir -p precedes its first ln, in config order, without repeats."""
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            for name in ("a.pt", "b.pt", "c.pt"):
+                (tmp / name).write_bytes(b"x")
+            models_toml = tmp / "models.toml"
+            models_toml.write_text(
+                f'[a]\ntype = "custom"\npath = "{tmp}/a.pt"\ncontainer_path = "/app/m/x"\n'
+                f'[b]\ntype = "custom"\npath = "{tmp}/b.pt"\ncontainer_path = "/app/m/x/y.pt"\n'
+                f'[c]\ntype = "custom"\npath = "{tmp}/c.pt"\ncontainer_path = "/app/m/z.pt"\n'
+            )
+            with patch.object(prepare_models, "MODELS_DIR", tmp / "models"), \
+                 patch.object(prepare_models, "ENTRYPOINT", tmp / "entrypoint.sh"), \
+                 patch.object(prepare_models, "MODELS_TOML", models_toml):
+                prepare_models.load_config.cache_clear()
+                try:
+                    prepare_models.main()
+                finally:
+                    prepare_models.load_config.cache_clear()
+            lines = (tmp / "entrypoint.sh").read_text().splitlines()
+
+        commands = [line for line in lines if line.startswith(("mkdir", "ln"))]
+        self.assertEqual(commands, [
+            "mkdir -p /app/m",
+            "ln -sf /app/models/a.pt /app/m/x",
+            "mkdir -p /app/m/x",
+            "ln -sf /app/models/b.pt /app/m/x/y.pt",
+            "ln -sf /app/models/c.pt /app/m/z.pt",
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
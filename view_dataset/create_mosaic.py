@@ -4,24 +4,28 @@ Script to create before/after mosaics for demo purposes.
 Creates two mosaics: one without annotations and one with annotations.
 """
 
+import functools
 import json
 import os
+import re
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import random
+from view_utils import decode_image, get_text_size, json_loads
 
 def load_labels_jsonl(labels_file_path):
     """Load labels from JSONL file."""
     try:
-        labels_data = []
-        with open(labels_file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    labels_data.append(json.loads(line.strip()))
+        # Read the whole file in one call and split once; bytes go straight
+        # to the parser without a per-line decode
+        with open(labels_file_path, 'rb') as f:
+            content = f.read()
+        labels_data = [json_loads(line) for line in content.split(b"\n") if line.strip()]
         
         print(f"Loaded {len(labels_data)} images")
         return labels_data
@@ -32,30 +36,17 @@ def load_labels_jsonl(labels_file_path):
         print(f"Error decoding JSON: {e}")
         sys.exit(1)
 
+# '/output_frames/', 'output_frames/' or './output_frames/', plus an optional
+# 'data/' since base_dir already points to the data directory
+_OUTPUT_FRAMES_PREFIX_RE = re.compile(r'(?:\.?/)?output_frames/(?:data/)?')
+
+@functools.lru_cache(maxsize=8192)
 def get_image_path(image_path, base_dir):
     """Get absolute path of image"""
     # Handle different path formats
-    if image_path.startswith('/output_frames/'):
-        # Remove '/output_frames/' prefix and use base_dir
-        image_path = image_path[15:]  # Remove '/output_frames/' (15 chars)
-        # If the path starts with 'data/', remove it since base_dir already points to data directory
-        if image_path.startswith('data/'):
-            image_path = image_path[5:]  # Remove 'data/' prefix
-        return os.path.join(base_dir, image_path)
-    elif image_path.startswith('output_frames/'):
-        # Remove 'output_frames/' prefix (length 14)
-        image_path = image_path[14:]
-        # If the path starts with 'data/', remove it since base_dir already points to data directory
-        if image_path.startswith('data/'):
-            image_path = image_path[5:]  # Remove 'data/' prefix
-        return os.path.join(base_dir, image_path)
-    elif image_path.startswith('./output_frames/'):
-        # Remove './output_frames/' prefix
-        image_path = image_path[16:]
-        # If the path starts with 'data/', remove it since base_dir already points to data directory
-        if image_path.startswith('data/'):
-            image_path = image_path[5:]  # Remove 'data/' prefix
-        return os.path.join(base_dir, image_path)
+    match = _OUTPUT_FRAMES_PREFIX_RE.match(image_path)
+    if match:
+        return os.path.join(base_dir, image_path[match.end():])
     elif os.path.isabs(image_path):
         # Already absolute path
         return image_path
@@ -63,18 +54,35 @@ def get_image_path(image_path, base_dir):
         # Relative path - join with base_dir
         return os.path.join(base_dir, image_path)
 
-def draw_labels_on_image(image, labels):
-    """Draw only PRESENT classification labels on image with colors."""
+def draw_labels_on_image(image, labels, source_size=None):
+    """Draw only PRESENT classification labels on image with colors.
+
+    If image is a mosaic tile, source_size is the (width, height) of the
+    full-size source it was cropped and resized from. The layout is then
+    computed at source size, as if drawn there before resizing, and mapped
+    onto the tile so text keeps the same proportions at any tile size.
+    """
     height, width = image.shape[:2]
     
+    # Map source coordinates onto the tile the same way
+    # resize_image_for_mosaic crops and scales
+    if source_size is None:
+        source_size = (width, height)
+    src_width, src_height = source_size
+    scale = max(width / src_width, height / src_height)
+    start_x = (src_width - min(src_width, round(width / scale))) // 2
+    start_y = (src_height - min(src_height, round(height / scale))) // 2
+    
     # Text settings - make labels very large to cover most of the image
     font = cv2.FONT_HERSHEY_SIMPLEX
-    font_scale = max(2.0, min(8.0, width / 100))  # Much larger scale for mosaic
-    thickness = max(3, int(width / 100))  # Much thicker
+    font_scale = max(2.0, min(8.0, src_width / 100)) * scale  # Much larger scale for mosaic
+    thickness = max(1, round(max(3, int(src_width / 100)) * scale))  # Much thicker
+    padding = round(max(10, int(src_width * 0.05)) * scale)  # Larger padding
     
     # Position for labels - center of image
-    y_offset = int(height * 0.5)  # Center vertically
-    x_offset = int(width * 0.1)  # Start from left side
+    y_offset = round((int(src_height * 0.5) - start_y) * scale)  # Center vertically
+    x_offset = round((int(src_width * 0.1) - start_x) * scale)  # Start from left side
+    y_step = round(int(src_height * 0.3) * scale)  # Much more space between labels
     
     # Get only present labels
     present_labels = []
@@ -87,8 +95,7 @@ def draw_labels_on_image(image, labels):
     if not present_labels:
         text = "No objects detected"
         color = (128, 128, 128)  # Gray
-        (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, thickness)
-        padding = max(10, int(width * 0.05))  # Larger padding
+        (text_width, text_height), _ = get_text_size(text, font, font_scale, thickness)
         cv2.rectangle(image, (x_offset - padding, y_offset - text_height - padding), 
                      (x_offset + text_width + padding, y_offset + padding), (0, 0, 0), -1)
         cv2.putText(image, text, (x_offset, y_offset), font, font_scale, color, thickness)
@@ -103,34 +110,80 @@ def draw_labels_on_image(image, labels):
         text = f"{label_name}"
         
         # Draw text with background - make it cover most of the image
-        (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, thickness)
-        padding = max(10, int(width * 0.05))  # Smaller padding for smaller rectangle
+        (text_width, text_height), _ = get_text_size(text, font, font_scale, thickness)
         cv2.rectangle(image, (x_offset - padding, y_offset - text_height - padding), 
                      (x_offset + text_width + padding, y_offset + padding), (0, 0, 0), -1)
         cv2.putText(image, text, (x_offset, y_offset), font, font_scale, color, thickness)
-        y_offset += int(height * 0.3)  # Much more space between labels
+        y_offset += y_step
     
     return image
 
-def resize_image_for_mosaic(image, target_size=(400, 400)):
-    """Resize image to target size while maintaining aspect ratio - images will be cropped to fit exactly."""
+def resize_image_for_mosaic(image, target_size=(400, 400), dst=None):
+    """Resize image to target size while maintaining aspect ratio - images will be cropped to fit exactly.
+
+    If dst is given (e.g. a slice of the mosaic), the result is written into it.
+    """
     height, width = image.shape[:2]
     
     # Calculate scale to fill the target size (may crop but won't stretch)
     scale = max(target_size[0] / width, target_size[1] / height)
-    new_width = int(width * scale)
-    new_height = int(height * scale)
     
-    # Resize image
-    resized = cv2.resize(image, (new_width, new_height))
+    # Crop the source to the region that maps onto the target first (a view,
+    # no copy), then resize once. This skips the oversized intermediate that
+    # resize-then-crop allocates and always yields exactly target_size.
+    crop_width = min(width, round(target_size[0] / scale))
+    crop_height = min(height, round(target_size[1] / scale))
+    start_x = (width - crop_width) // 2
+    start_y = (height - crop_height) // 2
+    
+    cropped = image[start_y:start_y + crop_height, start_x:start_x + crop_width]
     
-    # Crop to exact target size from center
-    start_x = (new_width - target_size[0]) // 2
-    start_y = (new_height - target_size[1]) // 2
+    # Area sampling when shrinking: it averages the source pixels instead of
+    # aliasing, and is cheap at large reduction factors
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    return cv2.resize(cropped, target_size, dst=dst, interpolation=interpolation)
+
+@functools.lru_cache(maxsize=32)
+def load_tile_image(full_image_path, target_size):
+    """Return (image, full-scale (width, height), None), or (None, None, warning) if unreadable."""
+    # The open doubles as the existence check
+    try:
+        with open(full_image_path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None, None, f"Warning: Image not found: {full_image_path}"
+    except OSError:
+        return None, None, f"Warning: Could not load image: {full_image_path}"
+    # The tile is cropped to fill target_size, so the decode must cover it
+    image, source_size = decode_image(content, target_size, cover=True)
+    if image is None:
+        return None, None, f"Warning: Could not load image: {full_image_path}"
+    return image, source_size, None
+
+def prepare_tile(image_path, labels, base_dir, with_annotations, target_size, dst=None):
+    """Load, resize and optionally annotate one mosaic tile into dst.
+
+    Returns (tile, None) on success or (None, warning) if the image is unusable,
+    so warnings can be printed in mosaic order by the caller.
+    """
+    # Get full image path
+    full_image_path = get_image_path(image_path, base_dir)
+    
+    # Load image (cached and shared by both mosaics, so never drawn on)
+    image, source_size, warning = load_tile_image(full_image_path, tuple(target_size))
+    if image is None:
+        return None, warning
     
-    cropped = resized[start_y:start_y + target_size[1], start_x:start_x + target_size[0]]
+    # Resize for mosaic
+    tile = resize_image_for_mosaic(image, target_size, dst)
     
-    return cropped
+    # Add annotations if requested, on the tile rather than the full-size
+    # source so text drawing only touches target_size pixels. The layout is
+    # still sized from the source.
+    if with_annotations:
+        draw_labels_on_image(tile, labels, source_size)
+    
+    return tile, None
 
 def create_mosaic(images, labels_data, base_dir, output_path, with_annotations=True, grid_size=(5, 2), target_size=(400, 400)):
     """Create a mosaic of images."""
@@ -142,42 +195,40 @@ def create_mosaic(images, labels_data, base_dir, output_path, with_annotations=T
     mosaic_height = rows * target_size[1] + (rows - 1) * row_spacing
     mosaic = np.zeros((mosaic_height, mosaic_width, 3), dtype=np.uint8)
     
-    # Process images
-    for i, (image_path, labels) in enumerate(zip(images, labels_data)):
-        if i >= rows * cols:
-            break
-            
-        # Get full image path
-        full_image_path = get_image_path(image_path, base_dir)
-        
-        if not os.path.exists(full_image_path):
-            print(f"Warning: Image not found: {full_image_path}")
-            continue
-        
-        # Load image
-        image = cv2.imread(full_image_path)
-        if image is None:
-            print(f"Warning: Could not load image: {full_image_path}")
-            continue
-        
-        # Add annotations if requested
-        if with_annotations:
-            image = draw_labels_on_image(image, labels)
-        
-        # Resize for mosaic
-        resized_image = resize_image_for_mosaic(image, target_size)
-        
-        # Calculate position in mosaic with row spacing
-        row = i // cols
-        col = i % cols
-        
-        y_start = row * (target_size[1] + row_spacing)
-        y_end = y_start + target_size[1]
-        x_start = col * target_size[0]
-        x_end = x_start + target_size[0]
-        
-        # Place image in mosaic
-        mosaic[y_start:y_end, x_start:x_end] = resized_image
+    # View the mosaic as a (rows, cols) grid of tiles that steps over the row
+    # spacing. grid[row, col] is that tile's slice of the mosaic; each tile
+    # is resized straight into it, with no per-tile array to copy in after.
+    row_stride, col_stride, channel_stride = mosaic.strides
+    grid = np.lib.stride_tricks.as_strided(
+        mosaic,
+        shape=(rows, cols, target_size[1], target_size[0], 3),
+        strides=((target_size[1] + row_spacing) * row_stride, target_size[0] * col_stride,
+                 row_stride, col_stride, channel_stride),
+    )
+    tiles = [
+        (image_path, labels, grid[divmod(i, cols)])
+        for i, (image_path, labels) in enumerate(list(zip(images, labels_data))[:rows * cols])
+    ]
+    
+    def run(tile):
+        image_path, labels, dst = tile
+        return prepare_tile(image_path, labels, base_dir, with_annotations, target_size, dst)
+    
+    # Tiles are independent and OpenCV releases the GIL in imread/resize/putText,
+    # so decode them on a thread pool. Workers write disjoint mosaic slices.
+    # One OpenCV thread per call keeps them from oversubscribing the cores.
+    cv_threads = cv2.getNumThreads()
+    cv2.setNumThreads(1)
+    try:
+        with ThreadPoolExecutor(max_workers=min(32, os.cpu_count() or 4)) as executor:
+            for (_, _, dst), (resized_image, warning) in zip(tiles, executor.map(run, tiles)):
+                if resized_image is None:
+                    print(warning)
+                elif resized_image is not dst:
+                    # OpenCV allocated its own output instead of using the slice
+                    dst[...] = resized_image
+    finally:
+        cv2.setNumThreads(cv_threads)
     
     # Save mosaic
     cv2.imwrite(output_path, mosaic)
@@ -244,35 +295,42 @@ def main():
     else:
         num_images = min(args.num_images, len(labels_data))
     selected_indices = random.sample(range(len(labels_data)), num_images)
-    selected_data = [labels_data[i] for i in selected_indices]
+    # Extracted once and shared by both mosaics
+    selected_images = tuple(labels_data[i]['image'] for i in selected_indices)
+    selected_labels = tuple(labels_data[i]['labels'] for i in selected_indices)
     
     print(f"Selected {num_images} images for mosaic")
     
-    # Create before mosaic (without annotations)
     before_path = os.path.join(output_dir, "mosaic_before.png")
-    print("Creating 'before' mosaic (without annotations)...")
-    create_mosaic(
-        [item['image'] for item in selected_data],
-        [item['labels'] for item in selected_data],
-        images_dir,
-        before_path,
-        with_annotations=False,
-        grid_size=grid_size,
-        target_size=target_size
-    )
-    
-    # Create after mosaic (with annotations)
     after_path = os.path.join(output_dir, "mosaic_after.png")
-    print("Creating 'after' mosaic (with annotations)...")
-    create_mosaic(
-        [item['image'] for item in selected_data],
-        [item['labels'] for item in selected_data],
-        images_dir,
-        after_path,
-        with_annotations=True,
-        grid_size=grid_size,
-        target_size=target_size
-    )
+    try:
+        # Create before mosaic (without annotations)
+        print("Creating 'before' mosaic (without annotations)...")
+        create_mosaic(
+            selected_images,
+            selected_labels,
+            images_dir,
+            before_path,
+            with_annotations=False,
+            grid_size=grid_size,
+            target_size=target_size
+        )
+        
+        # Create after mosaic (with annotations)
+        print("Creating 'after' mosaic (with annotations)...")
+        create_mosaic(
+            selected_images,
+            selected_labels,
+            images_dir,
+            after_path,
+            with_annotations=True,
+            grid_size=grid_size,
+            target_size=target_size
+        )
+    finally:
+        # The decodes are only shared between these two mosaics; release
+        # them rather than keep full-size frames alive for the process
+        load_tile_image.cache_clear()
     
     print(f"\n✅ Mosaics created successfully!")
     print(f"📁 Before (no annotations): {before_path}")
@@ -20,20 +20,26 @@ import json
 import os
 import sys
 import argparse
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import cv2
 import numpy as np
+from view_utils import decode_image, get_text_size, json_loads
 
-def _load_env_from_files():
-    """Load environment variables from a .env file if present.
+@functools.lru_cache(maxsize=1)
+def _dotenv_dict():
+    """Parse the first .env file found and return its KEY=VALUE pairs.
     
     Search order (first found is used):
     1) Current working directory /.env
     2) Repository root (parent of this script's directory) /.env
 
-    Existing environment variables are not overridden.
     Only simple KEY=VALUE lines are supported; lines starting with '#' are ignored.
+    The result is cached, so repeated calls do not re-read the file.
     """
+    values = {}
     try:
         script_dir = Path(__file__).parent
         candidates = [
@@ -52,13 +58,24 @@ def _load_env_from_files():
                         key, value = line.split('=', 1)
                         key = key.strip()
                         value = value.strip().strip('"').strip("'")
-                        # Do not override already-set variables
-                        if key and key not in os.environ:
-                            os.environ[key] = value
+                        if key:
+                            values.setdefault(key, value)
                 break  # stop after the first .env found
     except Exception:
         # Fail silently; fallback paths/env will still work
         pass
+    return values
+
+def _load_env_from_files():
+    """Load environment variables from a .env file if present.
+
+    Existing environment variables are not overridden.
+    """
+    # Both paths already configured: nothing a .env could add
+    if os.getenv('LABELS_FILE') and os.getenv('IMAGES_DIR'):
+        return
+    for key, value in _dotenv_dict().items():
+        os.environ.setdefault(key, value)
 
 def load_labels(labels_file_path):
     """Load labels from .jsonl (JSON Lines) or .json (array/object) file.
@@ -70,34 +87,34 @@ def load_labels(labels_file_path):
     try:
         path = Path(labels_file_path)
         is_jsonl_ext = path.suffix.lower() == '.jsonl'
-        with open(labels_file_path, 'r', encoding='utf-8') as f:
-            if is_jsonl_ext:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        data.append(json.loads(line))
-            else:
-                content = f.read().strip()
-                # Heuristic: if content seems to have newlines with braces frequently, try jsonl first
-                if '\n{' in content or '\n[' in content:
-                    # Try parse as jsonl; if fails, fallback to single json
-                    try:
-                        for line in content.splitlines():
-                            line = line.strip()
-                            if line:
-                                data.append(json.loads(line))
-                    except json.JSONDecodeError:
-                        obj = json.loads(content)
-                        if isinstance(obj, list):
-                            data = obj
-                        else:
-                            data = [obj]
-                else:
-                    obj = json.loads(content)
+        # Binary mode: the parser takes UTF-8 bytes directly, so lines are never
+        # decoded to str first. The file is read in one call and split once.
+        with open(labels_file_path, 'rb') as f:
+            content = f.read()
+        if is_jsonl_ext:
+            data = [json_loads(line) for line in content.split(b'\n') if line.strip()]
+        else:
+            content = content.strip()
+            # Heuristic: if content seems to have newlines with braces frequently, try jsonl first
+            if b'\n{' in content or b'\n[' in content:
+                # Try parse as jsonl; if fails, fallback to single json
+                try:
+                    for line in content.splitlines():
+                        line = line.strip()
+                        if line:
+                            data.append(json_loads(line))
+                except json.JSONDecodeError:
+                    obj = json_loads(content)
                     if isinstance(obj, list):
                         data = obj
                     else:
                         data = [obj]
+            else:
+                obj = json_loads(content)
+                if isinstance(obj, list):
+                    data = obj
+                else:
+                    data = [obj]
 
         # Normalize to expected structure: { 'image': <path>, 'labels': {<name>: {present, confidence}} }
         def normalize_item(raw_item):
@@ -138,45 +155,54 @@ def load_labels(labels_file_path):
         print(f"Error decoding JSON: {e}")
         sys.exit(1)
 
+_OUTPUT_FRAMES_PREFIXES = ('output_frames/', './output_frames/')
+
 def get_image_path(image_path, base_dir):
     """Get absolute path of image"""
     if not os.path.isabs(image_path):
-        # Handle different path formats
-        if image_path.startswith('output_frames/'):
-            # Remove 'output_frames/' prefix (length 14)
-            image_path = image_path[14:]
-        elif image_path.startswith('./output_frames/'):
-            # Remove './output_frames/' prefix
-            image_path = image_path[16:]
+        # Handle different path formats: drop the first matching prefix
+        for prefix in _OUTPUT_FRAMES_PREFIXES:
+            if image_path.startswith(prefix):
+                image_path = image_path[len(prefix):]
+                break
         
         # Remove leading slash if it exists
-        if image_path.startswith('/'):
-            image_path = image_path[1:]
+        image_path = image_path.removeprefix('/')
         
         # Join with base_dir
         return os.path.join(base_dir, image_path)
     return image_path
 
-def draw_labels_on_image(image, labels, all_classes=None):
+def draw_labels_on_image(image, labels, all_classes=None, source_size=None):
     """Draw classification labels on image with colors.
 
     If all_classes is provided, show all classes (present or absent).
     Otherwise, show only keys in labels.
+    If image was shrunk for display, source_size is the (width, height) of the
+    full-size image: the layout is computed at that size and scaled down, so
+    the legend keeps the same proportions as when drawn before resizing.
     """
     height, width = image.shape[:2]
+    if source_size is None:
+        source_size = (width, height)
+    src_width, src_height = source_size
+    scale = width / src_width
     
     # Text settings - make proportional to image size
     font = cv2.FONT_HERSHEY_SIMPLEX
-    font_scale = max(0.5, min(2.0, width / 400))  # Scale between 0.5 and 2.0 based on image width
-    thickness = max(1, int(width / 300))  # Thickness proportional to image width
+    font_scale = max(0.5, min(2.0, src_width / 400)) * scale  # Scale between 0.5 and 2.0 based on image width
+    thickness = max(1, round(max(1, int(src_width / 300)) * scale))  # Thickness proportional to image width
     
     # Position for labels - proportional to image size
-    y_offset = int(height * 0.05)  # 5% of image height
-    x_offset = int(width * 0.02)   # 2% of image width
+    y_offset = round(int(src_height * 0.05) * scale)  # 5% of image height
+    x_offset = round(int(src_width * 0.02) * scale)   # 2% of image width
+    y_step = round(int(src_height * 0.08) * scale)    # 8% of image height between labels
+    padding = round(max(5, int(src_width * 0.01)) * scale)  # Padding proportional to image width
     
     class_iterable = list(all_classes) if all_classes else list(labels.keys())
+    rows = []
     for label_name in class_iterable:
-        label_data = labels.get(label_name, {})
+        label_data = labels.get(label_name) or {}
         present = label_data.get('present', False)
         confidence = label_data.get('confidence', 0.0)
         
@@ -185,17 +211,34 @@ def draw_labels_on_image(image, labels, all_classes=None):
         
         # Show ALL labels (both present and absent)
         text = f"{label_name}: {'PRESENT' if present else 'ABSENT'} ({confidence:.2f})"
-        
-        # Draw text with background
-        (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, thickness)
-        padding = max(5, int(width * 0.01))  # Padding proportional to image width
-        cv2.rectangle(image, (x_offset - padding, y_offset - text_height - padding), 
-                     (x_offset + text_width + padding, y_offset + padding), (0, 0, 0), -1)
+        rows.append((text, color))
+    
+    if not rows:
+        return image
+    
+    # One background rectangle behind the whole legend, sized to the widest row
+    text_width = max(get_text_size(text, font, font_scale, thickness)[0][0] for text, _ in rows)
+    text_height = get_text_size(rows[0][0], font, font_scale, thickness)[0][1]
+    last_y = y_offset + (len(rows) - 1) * y_step
+    cv2.rectangle(image, (x_offset - padding, y_offset - text_height - padding), 
+                 (x_offset + text_width + padding, last_y + padding), (0, 0, 0), -1)
+    
+    for text, color in rows:
         cv2.putText(image, text, (x_offset, y_offset), font, font_scale, color, thickness)
-        y_offset += int(height * 0.08)  # 8% of image height between labels
+        y_offset += y_step
     
     return image
 
+def read_image(image_path, max_size=(1200, 800)):
+    """Return (image, full-scale (width, height)) for display, or (None, None) if unreadable."""
+    try:
+        with open(image_path, 'rb') as f:
+            content = f.read()
+    except OSError:
+        return None, None
+    # The viewer shrinks anything bigger than max_size, so the decode only has to fit it
+    return decode_image(content, max_size)
+
 def parse_arguments():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(
@@ -212,6 +255,9 @@ Examples:
     # Specify custom images directory
     python show_labels.py --images-dir /path/to/images
     
+    # Print the resolved image path for every frame
+    python show_labels.py --verbose
+    
     # Use environment variables
     LABELS_FILE=/path/to/labels.jsonl IMAGES_DIR=/path/to/images python show_labels.py
         """
@@ -229,6 +275,12 @@ Examples:
         help='Base directory for images (default: auto-detected from labels file)'
     )
     
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Print the resolved image path for every frame shown'
+    )
+    
     return parser.parse_args()
 
 def get_default_paths():
@@ -239,7 +291,91 @@ def get_default_paths():
         'images_dir': script_dir.parent / "output_frames"
     }
 
-def show_images_with_labels(labels_file_path=None, images_dir_path=None):
+NAV_TEXT = "< > ^ v or A/D to navigate, ESC to exit"
+
+def draw_boxed_text(image, text, y, font_scale, scale=1.0):
+    """Draw white text in a black, white-bordered box with its baseline at row y.
+
+    Sizes are those of the full-size frame, multiplied by scale.
+    """
+    font_scale *= scale
+    thickness = max(1, round(2 * scale))
+    (text_w, text_h), _ = get_text_size(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+    text_x = round(20 * scale)
+    pad = round(5 * scale)
+    top_left = (round(15 * scale), y - text_h - pad)
+    bottom_right = (text_x + text_w + pad, y + pad)
+    cv2.rectangle(image, top_left, bottom_right, (0, 0, 0), -1)
+    cv2.rectangle(image, top_left, bottom_right, (255, 255, 255), thickness)
+    cv2.putText(image, text, (text_x, y), 
+               cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), thickness)
+
+def draw_nav_caption(image, nav_y, scale=1.0):
+    """Draw the boxed navigation hint with its baseline at row nav_y."""
+    draw_boxed_text(image, NAV_TEXT, nav_y, 0.7, scale)
+
+@functools.lru_cache(maxsize=32)
+def get_nav_sprite(scale=1.0):
+    """Return (sprite, mask, baseline): the navigation hint pre-rendered at this display scale."""
+    (nav_w, nav_h), _ = get_text_size(NAV_TEXT, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
+    margin = 10  # room for the box border and glyph descenders
+    baseline = nav_h + 5 + margin
+    shape = (baseline + 5 + margin, 25 + nav_w + margin, 3)
+    # The caption covers exactly the pixels that match on black and on white
+    layers = []
+    for fill in (0, 255):
+        canvas = np.full(shape, fill, dtype=np.uint8)
+        draw_nav_caption(canvas, baseline, scale)
+        layers.append(canvas)
+    mask = (layers[0] == layers[1]).all(axis=2, keepdims=True)
+    return layers[0], mask, baseline
+
+def render_frame(image, labels, all_classes, info_text, source_size=None):
+    """Return image shrunk to fit the screen, with labels and the info/navigation footer drawn."""
+    # Resize if too large. Done before any drawing so text is rasterized at
+    # display size, not over the full-resolution frame.
+    max_width = 1200
+    max_height = 800
+    height, width = image.shape[:2]
+    if source_size is None:
+        source_size = (width, height)
+    src_width, src_height = source_size
+    
+    scale = 1.0
+    if src_width > max_width or src_height > max_height:
+        scale = min(max_width/src_width, max_height/src_height)
+    new_size = (int(src_width * scale), int(src_height * scale))
+    if (width, height) != new_size:
+        image = cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+    
+    # Draw labels (ensure all classes are shown). The image is a fresh
+    # decode or resize that is not used again, so draw on it in place.
+    image_with_labels = draw_labels_on_image(image, labels, all_classes=all_classes,
+                                             source_size=source_size)
+    
+    # Add image info and navigation with better visibility
+    info_y = round((src_height - 60) * scale)
+    nav_y = round((src_height - 20) * scale)
+    
+    # Boxed info text
+    draw_boxed_text(image_with_labels, info_text, info_y, 0.8, scale)
+    
+    # Navigation hint never changes: blit the pre-rendered caption when it
+    # fits, otherwise draw it (clipped) directly. The scale is rounded for
+    # the sprite cache; at 3 decimals the caption moves by well under a pixel.
+    nav_scale = round(scale, 3)
+    sprite, mask, baseline = get_nav_sprite(nav_scale)
+    top = nav_y - baseline
+    height, width = image_with_labels.shape[:2]
+    if top >= 0 and top + sprite.shape[0] <= height and sprite.shape[1] <= width:
+        region = image_with_labels[top:top + sprite.shape[0], :sprite.shape[1]]
+        np.copyto(region, sprite, where=mask)
+    else:
+        draw_nav_caption(image_with_labels, nav_y, nav_scale)
+    
+    return image_with_labels
+
+def show_images_with_labels(labels_file_path=None, images_dir_path=None, verbose=False):
     """Show all images with labels and navigation"""
     # Load .env first (if present) so env vars become available
     _load_env_from_files()
@@ -278,13 +414,15 @@ def show_images_with_labels(labels_file_path=None, images_dir_path=None):
     # Load data
     data = load_labels(str(labels_file))
     
-    # Derive the set of all classes across the dataset
+    base_dir = str(images_dir)
+    
+    # Derive the set of all classes and resolve every image path once, so
+    # navigation does no string work
     all_classes = set()
+    image_paths = []
     for it in data:
-        lbls = it.get('labels', {}) or {}
-        for k in lbls.keys():
-            all_classes.add(k)
-    base_dir = str(images_dir)
+        all_classes.update(it.get('labels') or ())
+        image_paths.append(get_image_path(it['image'], base_dir))
     current_index = 0
     consecutive_not_found = 0
     
@@ -292,6 +430,29 @@ def show_images_with_labels(labels_file_path=None, images_dir_path=None):
     print(f"Images directory: {base_dir}")
     print("Navigation: ← → ↑ ↓ arrows or A/D keys to navigate, ESC to exit")
     
+    # Finished frames by index, so revisiting an image skips the decode and
+    # all drawing. Bounded: a frame is up to 1200x800x3 bytes.
+    rendered_frames = OrderedDict()
+    max_rendered_frames = 16
+    
+    # Paths already found missing, so passing them again costs no stat
+    missing_paths = set()
+    
+    # Decode and render the neighbouring frames in the background while the
+    # current one is on screen, so a step to either side is just an imshow
+    prefetcher = ThreadPoolExecutor(max_workers=2)
+    prefetched = {}  # dataset index -> Future of a rendered frame (or None)
+    
+    def load_and_render(index):
+        """Read and render data[index]; None if the image cannot be loaded."""
+        item = data[index]
+        image_path = image_paths[index]
+        image, source_size = read_image(image_path)
+        if image is None:
+            return None
+        info_text = f"Image {index+1}/{len(data)} - {os.path.basename(image_path)}"
+        return render_frame(image, item.get('labels', {}), all_classes, info_text, source_size)
+    
     while True:
         if current_index >= len(data):
             current_index = 0
@@ -299,74 +460,56 @@ def show_images_with_labels(labels_file_path=None, images_dir_path=None):
             current_index = len(data) - 1
             
         item = data[current_index]
-        image_path = get_image_path(item['image'], base_dir)
-        
-        print(f"Looking for image: {image_path}")
-        print(f"Original path from JSON: {item['image']}")
-        
-        if not os.path.exists(image_path):
-            print(f"Image not found: {image_path}")
-            consecutive_not_found += 1
-            if consecutive_not_found >= len(data):
-                print("No images found! Check if the images exist in the correct path.")
-                break
-            current_index += 1
-            continue
-        
-        consecutive_not_found = 0  # Reset counter when image is found
-        
-        # Load image
-        image = cv2.imread(image_path)
-        if image is None:
-            print(f"Error loading image: {image_path}")
-            current_index += 1
-            continue
-        
-        # Draw labels (ensure all classes are shown)
-        image_with_labels = draw_labels_on_image(image.copy(), item.get('labels', {}), all_classes=all_classes)
-        
-        # Add image info and navigation with better visibility
-        info_text = f"Image {current_index+1}/{len(data)} - {os.path.basename(image_path)}"
-        nav_text = "< > ^ v or A/D to navigate, ESC to exit"
-        
-        # Draw background rectangles for better text visibility
-        info_y = image_with_labels.shape[0] - 60
-        nav_y = image_with_labels.shape[0] - 20
+        image_path = image_paths[current_index]
         
-        # Background for info text
-        (info_w, info_h), _ = cv2.getTextSize(info_text, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
-        cv2.rectangle(image_with_labels, (15, info_y - info_h - 5), 
-                     (25 + info_w, info_y + 5), (0, 0, 0), -1)
-        cv2.rectangle(image_with_labels, (15, info_y - info_h - 5), 
-                     (25 + info_w, info_y + 5), (255, 255, 255), 2)
+        if verbose:
+            print(f"Looking for image: {image_path}")
+            print(f"Original path from JSON: {item['image']}")
         
-        # Background for navigation text
-        (nav_w, nav_h), _ = cv2.getTextSize(nav_text, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
-        cv2.rectangle(image_with_labels, (15, nav_y - nav_h - 5), 
-                     (25 + nav_w, nav_y + 5), (0, 0, 0), -1)
-        cv2.rectangle(image_with_labels, (15, nav_y - nav_h - 5), 
-                     (25 + nav_w, nav_y + 5), (255, 255, 255), 2)
-        
-        # Draw text with better contrast
-        cv2.putText(image_with_labels, info_text, (20, info_y), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-        cv2.putText(image_with_labels, nav_text, (20, nav_y), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        
-        # Resize if too large
-        max_width = 1200
-        max_height = 800
-        height, width = image_with_labels.shape[:2]
-        
-        if width > max_width or height > max_height:
-            scale = min(max_width/width, max_height/height)
-            new_width = int(width * scale)
-            new_height = int(height * scale)
-            image_with_labels = cv2.resize(image_with_labels, (new_width, new_height))
+        image_with_labels = rendered_frames.get(current_index)
+        if image_with_labels is not None:
+            consecutive_not_found = 0
+            rendered_frames.move_to_end(current_index)
+        else:
+            if image_path in missing_paths or not os.path.exists(image_path):
+                missing_paths.add(image_path)
+                print(f"Image not found: {image_path}")
+                consecutive_not_found += 1
+                if consecutive_not_found >= len(data):
+                    print("No images found! Check if the images exist in the correct path.")
+                    break
+                current_index += 1
+                continue
+            
+            consecutive_not_found = 0  # Reset counter when image is found
+            
+            # Load and render (prefetched if the previous step queued it)
+            future = prefetched.pop(current_index, None)
+            image_with_labels = future.result() if future is not None else load_and_render(current_index)
+            if image_with_labels is None:
+                print(f"Error loading image: {image_path}")
+                current_index += 1
+                continue
+            
+            rendered_frames[current_index] = image_with_labels
+            if len(rendered_frames) > max_rendered_frames:
+                rendered_frames.popitem(last=False)
         
         # Show image
         cv2.imshow('Image Labels Viewer', image_with_labels)
         
+        # Queue the previous and next frames unless already rendered; drop
+        # work nobody will ask for
+        neighbours = {
+            i % len(data) for i in (current_index - 1, current_index + 1)
+        } - rendered_frames.keys() - {current_index}
+        for index in list(prefetched):
+            if index not in neighbours:
+                prefetched.pop(index).cancel()
+        for index in neighbours:
+            if index not in prefetched:
+                prefetched[index] = prefetcher.submit(load_and_render, index)
+        
         # Wait for key and handle navigation
         key = cv2.waitKey(0) & 0xFF
         
@@ -381,6 +524,7 @@ def show_images_with_labels(labels_file_path=None, images_dir_path=None):
         elif key == 82 or key == 1:  # Up arrow
             current_index -= 1
     
+    prefetcher.shutdown(wait=False, cancel_futures=True)
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
@@ -390,5 +534,6 @@ if __name__ == "__main__":
     # Show images with specified or default paths
     show_images_with_labels(
         labels_file_path=args.labels_file,
-        images_dir_path=args.images_dir
+        images_dir_path=args.images_dir,
+        verbose=args.verbose
     )
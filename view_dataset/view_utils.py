@@ -0,0 +1,65 @@
+"""
+Helpers shared by show_labels.py and create_mosaic.py.
+"""
+
+import functools
+import io
+import json
+import cv2
+import numpy as np
+from PIL import Image
+
+try:
+    import orjson  # Faster parser for large labels files
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+@functools.lru_cache(maxsize=4096)
+def get_text_size(text, font, font_scale, thickness):
+    """Cached cv2.getTextSize; label and caption strings repeat on every image."""
+    return cv2.getTextSize(text, font, font_scale, thickness)
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 scale in the IDCT stage, so a
+# JPEG that will only be shown smaller is decoded at the largest reduction that
+# still yields target_size. Other formats are decoded at full size.
+_REDUCED_READ_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def decode_image(content, target_size, cover=False):
+    """Return (image, full-scale (width, height)) decoded from content, or (None, None).
+
+    The decoded image still fits target_size, or covers it if cover is True.
+    """
+    if not content:  # imdecode asserts on an empty buffer
+        return None, None
+
+    flag = cv2.IMREAD_COLOR
+    source_size = None
+    try:
+        # Only the header is parsed here, no pixels are decoded
+        with Image.open(io.BytesIO(content)) as img:
+            if img.format == 'JPEG':
+                width, height = img.size
+                if img.getexif().get(0x0112, 1) >= 5:
+                    # EXIF orientations 5-8 are decoded with the axes swapped
+                    width, height = height, width
+                source_size = (width, height)
+                pick = max if cover else min
+                scale = pick(target_size[0] / width, target_size[1] / height)
+                for factor, reduced_flag in _REDUCED_READ_FLAGS:
+                    if scale * factor <= 1:
+                        flag = reduced_flag
+                        break
+    except Exception:
+        pass
+
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), flag)
+    if image is None:
+        return None, None
+    if flag == cv2.IMREAD_COLOR:
+        source_size = (image.shape[1], image.shape[0])
+    return image, source_size